@@ -1,10 +1,24 @@
+import hashlib
+import io
 import os
-import glob
-import textwrap
-from typing import Dict, Optional
+import queue
+import re
+import tempfile
+import threading
+import uuid
+import weakref
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Set
 
 import pandas as pd
 import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
@@ -26,80 +40,545 @@ DARK_CSS = """
 st.markdown(DARK_CSS, unsafe_allow_html=True)
 
 # ------------------------- Helpers -------------------------
-@st.cache_data(show_spinner=False)
-def load_csvs_from_folder(folder_path: str) -> Dict[str, pd.DataFrame]:
-    """Load all CSV files in a folder and return a dict of DataFrames keyed by filename (without extension)."""
-    files = glob.glob(os.path.join(folder_path, "*.csv"))
-    dfs: Dict[str, pd.DataFrame] = {}
-    for fpath in files:
-        key = os.path.splitext(os.path.basename(fpath))[0]
+@st.cache_data(ttl=30, show_spinner=False)
+def scan_csv_files(folder_path: str, dir_mtime_ns: int) -> List[str]:
+    """Scan a folder for CSV files. `dir_mtime_ns` is only a cache key: it changes when files are added or removed."""
+    return sorted(e.path for e in os.scandir(folder_path) if e.name.endswith('.csv') and not e.name.startswith('.') and e.is_file())
+
+
+def list_csv_files(folder_path: str) -> List[str]:
+    """Return the CSV files in a folder, sorted by name (empty if the folder does not exist)."""
+    try:
+        dir_mtime_ns = os.stat(folder_path).st_mtime_ns
+    except OSError:
+        return []
+    return scan_csv_files(folder_path, dir_mtime_ns)
+
+
+def table_name_for(fpath: str) -> str:
+    """Table name used for a CSV file: the filename without extension."""
+    return os.path.splitext(os.path.basename(fpath))[0]
+
+
+# candidate column types for CSVs loaded through pandas, tried in order; a column gets the first
+# type every non-null value converts to exactly (TRY_CAST alone would round '7.5' to BIGINT 8
+# and truncate timestamps to DATE, hence the patterns), else VARCHAR
+FALLBACK_TYPES = [
+    ("BIGINT", r"\s*[+-]?\d+\s*"),
+    ("DOUBLE", None),
+    ("DATE", r"\s*\d{4}-\d{2}-\d{2}\s*"),
+    ("TIMESTAMP", None),
+]
+
+
+def fallback_column_types(cur, table: str) -> Dict[str, str]:
+    """Pick a type for every VARCHAR column of `table` from FALLBACK_TYPES, in a single scan. All-null columns stay VARCHAR."""
+    columns = [d[0] for d in cur.execute(f"SELECT * FROM \"{table}\" LIMIT 0").description]
+    checks = []
+    for col in columns:
+        checks.append(f"count(\"{col}\") > 0")
+        for sql_type, pattern in FALLBACK_TYPES:
+            ok = f"TRY_CAST(\"{col}\" AS {sql_type}) IS NOT NULL"
+            if pattern:
+                ok = f"regexp_full_match(\"{col}\", '{pattern}') AND {ok}"
+            checks.append(f"bool_and(\"{col}\" IS NULL OR ({ok}))")
+    row = cur.execute(f"SELECT {', '.join(checks)} FROM \"{table}\"").fetchone()
+    width = len(FALLBACK_TYPES) + 1
+    types = {}
+    for i, col in enumerate(columns):
+        has_values, *fits = row[i * width:(i + 1) * width]
+        types[col] = next((t for (t, _), ok in zip(FALLBACK_TYPES, fits) if ok), "VARCHAR") if has_values else "VARCHAR"
+    return types
+
+
+FALLBACK_CHUNK_ROWS = 200_000
+
+
+def load_csv_with_pandas(con, name: str, fpath: str) -> None:
+    """
+    Load a single CSV with pandas into table `name`. Only used when DuckDB's CSV reader rejects a file.
+
+    The file is read in chunks of FALLBACK_CHUNK_ROWS, all as text, and each chunk is appended to
+    a VARCHAR staging table, so at most one chunk is held in pandas at a time and a value in a
+    late chunk can never clash with types guessed from an earlier one. Column types are then
+    decided once over the whole file (see `fallback_column_types`) and cast in DuckDB. Uses its
+    own cursor so several files can load concurrently on one connection.
+    """
+    cur = con.cursor()
+    staging = f"{name}__staging"
+    for engine in ("c", "python"):
         try:
-            df = pd.read_csv(fpath, low_memory=False)
-        except Exception:
+            for i, chunk in enumerate(pd.read_csv(fpath, engine=engine, chunksize=FALLBACK_CHUNK_ROWS, dtype=str)):
+                if i == 0:
+                    cur.register("_chunk", chunk)
+                    cur.execute(f"CREATE OR REPLACE TABLE \"{staging}\" AS SELECT * FROM _chunk")
+                    cur.unregister("_chunk")
+                else:
+                    cur.append(staging, chunk)
+            break
+        except (ValueError, duckdb.Error):
             # fallback parser if there are parsing oddities
-            df = pd.read_csv(fpath, engine="python")
-        dfs[key] = df
-    return dfs
+            if engine == "python":
+                cur.execute(f"DROP TABLE IF EXISTS \"{staging}\"")
+                raise
+    types = fallback_column_types(cur, staging)
+    casts = ", ".join(f"CAST(\"{col}\" AS {sql_type}) AS \"{col}\"" for col, sql_type in types.items())
+    cur.execute(f"CREATE OR REPLACE TABLE \"{name}\" AS SELECT {casts} FROM \"{staging}\"")
+    cur.execute(f"DROP TABLE \"{staging}\"")
 
 
-def coerce_date_columns(dfs: Dict[str, pd.DataFrame], sample_size: int = 2000, threshold: float = 0.6) -> Dict[str, pd.DataFrame]:
-    """Auto-detect and coerce likely date columns to pandas datetime."""
-    coerced: Dict[str, pd.DataFrame] = {}
-    for name, df in dfs.items():
-        df = df.copy()
-        for col in df.columns:
-            try:
-                col_low = str(col).lower()
-                if 'date' in col_low or df[col].dtype == object:
-                    sample = df[col].dropna().astype(str).head(sample_size)
-                    if sample.empty:
-                        continue
-                    parsed = pd.to_datetime(sample, errors='coerce', infer_datetime_format=True)
-                    success_rate = parsed.notna().sum() / len(parsed)
-                    if success_rate >= threshold:
-                        df[col] = pd.to_datetime(df[col], errors='coerce', infer_datetime_format=True)
-            except Exception:
-                # if coercion causes issues, skip column
-                continue
-        coerced[name] = df
-    return coerced
+def csv_files_key(folder_path: str) -> tuple:
+    """Return a hashable (filename, mtime) snapshot of the CSVs in a folder, used as a cache key."""
+    return tuple((os.path.basename(f), os.path.getmtime(f)) for f in list_csv_files(folder_path))
+
 
+def parquet_cache_path(fpath: str) -> str:
+    """Parquet cache file for a CSV: `<folder>/.cache/<name>-<mtime_ns>-<size>.parquet`, so any change to the CSV misses."""
+    info = os.stat(fpath)
+    folder = os.path.dirname(fpath)
+    return os.path.join(folder, ".cache", f"{table_name_for(fpath)}-{info.st_mtime_ns}-{info.st_size}.parquet")
 
-def create_duckdb_connection(dfs: Dict[str, pd.DataFrame]):
+
+# options for DuckDB's CSV reader: type inference over the whole file, 'NULL' as the null
+# string, and short rows padded with NULLs (without it the sniffer falls back to reading such
+# a file as one VARCHAR column instead of rejecting it)
+CSV_READ_OPTIONS = "sample_size=-1, nullstr='NULL', null_padding=true"
+
+
+def load_csv_table(con, name: str, fpath: str) -> bool:
     """
-    Create an in-memory duckdb connection and register pandas tables.
+    Create `name` from one CSV file. Returns False if DuckDB's reader rejects the file,
+    in which case the caller falls back to pandas.
+
+    The CSV is converted once to Parquet under `<folder>/.cache/` and `name` is loaded from
+    that file, so later connections skip CSV parsing. The table is copied into memory rather
+    than kept as a view over the file, so deleting `.cache/` (or a newer connection clearing
+    stale files) never breaks a running connection. If the cache cannot be written the CSV is
+    loaded directly.
+    """
+    pq_path = parquet_cache_path(fpath)
+    if not os.path.exists(pq_path):
+        tmp_path = pq_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(pq_path), exist_ok=True)
+            tmp_literal = tmp_path.replace("'", "''")
+            con.execute(f"COPY (SELECT * FROM read_csv_auto(?, {CSV_READ_OPTIONS})) TO '{tmp_literal}' (FORMAT PARQUET, COMPRESSION ZSTD)", [fpath])
+            os.replace(tmp_path, pq_path)
+        except (duckdb.Error, OSError):
+            # rejected CSV or read-only folder — load the CSV directly below
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        else:
+            # drop caches of earlier versions of this CSV
+            stale = re.compile(re.escape(name) + r"-\d+-\d+\.parquet$")
+            for entry in os.scandir(os.path.dirname(pq_path)):
+                if stale.match(entry.name) and entry.path != pq_path:
+                    os.remove(entry.path)
 
-    Registers each DataFrame under:
+    if os.path.exists(pq_path):
+        try:
+            pq_literal = pq_path.replace("'", "''")
+            con.execute(f"CREATE TABLE \"{name}\" AS SELECT * FROM read_parquet('{pq_literal}')")
+            return True
+        except duckdb.Error:
+            # unreadable (or just deleted) cache file; fall back to the CSV
+            pass
+
+    try:
+        con.execute(f"CREATE TABLE \"{name}\" AS SELECT * FROM read_csv_auto(?, {CSV_READ_OPTIONS})", [fpath])
+    except duckdb.Error:
+        return False
+    return True
+
+
+@st.cache_resource(show_spinner=False)
+def connection_registry() -> SimpleNamespace:
+    """Process-wide per-connection state; an entry goes away with its connection."""
+    return SimpleNamespace(lock=threading.Lock(), entries=weakref.WeakKeyDictionary())
+
+
+def connection_state(con) -> SimpleNamespace:
+    """Cache token and idle-cursor pool of `con`, created on first use."""
+    registry = connection_registry()
+    with registry.lock:
+        state = registry.entries.get(con)
+        if state is None:
+            state = registry.entries[con] = SimpleNamespace(token=uuid.uuid4().hex, cursors=queue.SimpleQueue())
+    return state
+
+
+def connection_key(con) -> str:
+    """Cache key of a connection: unique for its lifetime, unlike id(), which is reused once it is freed."""
+    return connection_state(con).token
+
+
+@contextmanager
+def pooled_cursor(con):
+    """
+    Borrow a cursor of `con` that no other thread is using, with the names of its prepared statements.
+
+    Every session shares the cached connection but runs on its own thread, and a connection has
+    a single pending result, so queries never run on `con` itself. Cursors see the same tables
+    and views; results and prepared statements are per cursor.
+    """
+    cursors = connection_state(con).cursors
+    try:
+        cur, statements = cursors.get_nowait()
+    except queue.Empty:
+        cur, statements = con.cursor(), set()
+    try:
+        yield cur, statements
+    finally:
+        cursors.put((cur, statements))
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def create_duckdb_connection(folder_path: str, files_key: tuple):
+    """
+    Create an in-memory duckdb connection with one relation per CSV in the folder.
+
+    CSVs are parsed by DuckDB's own reader (`read_csv_auto`), which is multi-threaded
+    and infers column types, so no pandas copy of the data is kept around. Files are
+    loaded concurrently, one per worker thread; files the reader rejects fall back to a
+    chunked pandas load (`load_csv_with_pandas`). See `load_csv_table` for the Parquet
+    cache used on warm starts. SAVED_QUERIES are PREPAREd up front on the first pooled
+    cursor, so picking one usually only runs EXECUTE; other cursors prepare a query on first
+    use (see `prepare_statement`).
+
+    Each table is available under:
       - its original key (filename without extension)
       - a sanitized lowercase name with spaces -> underscores
 
     This increases resilience vs. naming mismatches.
+
+    Cached as a resource so the same connection survives reruns and is shared by all sessions
+    (queries go through `pooled_cursor`); `files_key` (see `csv_files_key`) changes whenever a
+    CSV is added, removed or modified, and only the latest connection is kept.
     """
-    con = duckdb.connect(database=':memory:')
-    for name, df in dfs.items():
-        # register original name if valid
-        try:
-            con.register(name, df)
-        except Exception:
-            # ignore if duckdb rejects the name
-            pass
+    # every core; insertion order stays preserved so the Parquet cache, raw previews, exports and
+    # unordered saved queries keep the CSV's row order.
+    # memory_limit keeps DuckDB's default (80% of RAM) unless DUCKDB_MEMORY_LIMIT is set, e.g. '4GB'
+    config = {'threads': os.cpu_count() or 1}
+    if os.environ.get('DUCKDB_MEMORY_LIMIT'):
+        config['memory_limit'] = os.environ['DUCKDB_MEMORY_LIMIT']
+    con = duckdb.connect(database=':memory:', config=config)
+    files = list_csv_files(folder_path)
+
+    def load(fpath: str) -> None:
+        name = table_name_for(fpath)
+        # each worker gets its own cursor; DuckDB serializes the catalog changes internally
+        if not load_csv_table(con.cursor(), name, fpath):
+            load_csv_with_pandas(con, name, fpath)
+
+    if files:
+        # one file per thread on top of DuckDB's own intra-file parallelism
+        with ThreadPoolExecutor(max_workers=min(8, len(files))) as ex:
+            list(ex.map(load, files))
 
-        # register sanitized name
+    for fpath in files:
+        # sanitized alias
+        name = table_name_for(fpath)
         table_name = name.lower().replace(' ', '_')
+        if table_name != name:
+            try:
+                con.execute(f"CREATE VIEW \"{table_name}\" AS SELECT * FROM \"{name}\"")
+            except Exception:
+                # ignore if the alias clashes with an existing table
+                pass
+
+    # refresh statistics for the loaded tables so the optimizer sees their row counts and distinct values
+    con.execute("ANALYZE")
+
+    # compile the saved queries on a borrowed cursor, which no other thread can touch meanwhile;
+    # ones that do not bind here report their error when run
+    with pooled_cursor(con) as (cur, statements):
+        for sql in SAVED_QUERIES.values():
+            try:
+                prepare_statement(cur, statements, sql)
+            except duckdb.Error:
+                pass
+    return con
+
+
+# query results are keyed on (connection, SQL); a changed folder gets a new connection, so
+# stale results are never served, and the TTL only bounds how long unused results are kept
+QUERY_CACHE_TTL = 3600
+
+
+def prepare_statement(cur, statements: Set[str], sql: str) -> str:
+    """
+    PREPARE `sql` on `cur` unless already done and return the statement name. `statements` holds
+    the names prepared on that cursor (see `pooled_cursor`). Raises duckdb.Error if it does not bind.
+
+    The name is derived from the SQL text, so one name never stands for two different queries, and
+    the registry is only touched by the thread that has borrowed the cursor.
+    """
+    name = "q_" + hashlib.sha1(sql.encode()).hexdigest()[:16]
+    if name not in statements:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        statements.add(name)
+    return name
+
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, show_spinner=False, hash_funcs={duckdb.DuckDBPyConnection: connection_key})
+def cached_query(con, sql: str, prepare: bool = False) -> pa.Table:
+    """
+    Execute SQL on a pooled cursor of `con` and return an Arrow table. Errors propagate, so
+    only successful results are cached; use `run_sql` to show them in the app instead.
+
+    With `prepare=True` the statement is PREPAREd once per pooled cursor and later runs
+    only EXECUTE it, skipping parse/bind/optimize.
+    """
+    with pooled_cursor(con) as (cur, statements):
+        if prepare:
+            return cur.execute(f"EXECUTE {prepare_statement(cur, statements, sql)}").to_arrow_table()
+        return cur.execute(sql).to_arrow_table()
+
+
+def run_sql(con, sql: str, prepare: bool = False) -> pa.Table:
+    """
+    Execute SQL on DuckDB connection and return an Arrow table. Errors are shown in the app.
+
+    Results stay in Arrow (no per-value Python objects); callers convert to pandas with
+    `to_pandas_zero_copy` only where Plotly needs a DataFrame. Results are cached per
+    connection and SQL text (see `cached_query`); use `prepare=True` for the fixed per-tab queries.
+    """
+    try:
+        return cached_query(con, sql, prepare)
+    except Exception as e:
+        st.error(f"SQL execution error: {e}")
+        return pa.table({})
+
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, show_spinner=False, hash_funcs={duckdb.DuckDBPyConnection: connection_key})
+def cached_custom_query(con, sql: str) -> pa.Table:
+    """
+    `cached_query` for user-entered SQL: runs on a throwaway cursor inside a transaction that is
+    always rolled back, so DDL or DML cannot change the connection every session shares.
+    """
+    cur = con.cursor()
+    try:
+        cur.begin()
+        return cur.execute(sql).to_arrow_table()
+    finally:
         try:
-            con.register(table_name, df)
-        except Exception:
+            cur.rollback()
+        except duckdb.Error:
+            # no transaction left open, e.g. the SQL ended it itself
             pass
-    return con
+        cur.close()
 
 
-def run_sql(con, sql: str) -> pd.DataFrame:
-    """Execute SQL on DuckDB connection and return a DataFrame. Errors are shown in the app."""
+def run_custom_sql(con, sql: str) -> pa.Table:
+    """`run_sql` for user-entered SQL (see `cached_custom_query`). Errors are shown in the app."""
     try:
-        return con.execute(sql).df()
+        return cached_custom_query(con, sql)
     except Exception as e:
         st.error(f"SQL execution error: {e}")
+        return pa.table({})
+
+
+def preview(con, sql: str, n: int) -> pa.Table:
+    """First `n` rows of a SELECT, limited inside DuckDB so only the preview rows are fetched."""
+    return run_sql(con, f"SELECT * FROM ({sql.strip().rstrip(';')}) LIMIT {int(n)}")
+
+
+def parquet_bytes(tbl: pa.Table) -> bytes:
+    """Serialize an Arrow table to an in-memory Parquet file (for download buttons)."""
+    buf = io.BytesIO()
+    pq.write_table(tbl, buf, compression="zstd")
+    return buf.getvalue()
+
+
+def tables_zip(con, table_names: tuple) -> bytes:
+    """
+    Every table as a ZSTD Parquet file in one ZIP archive (for the sidebar download). Not cached:
+    it is a copy of the whole database, built only when someone downloads it.
+
+    Each table is written with COPY under its own name rather than with EXPORT DATABASE,
+    which also exports the internal tables (e.g. `rental_fact`) and alias views.
+    """
+    cur = con.cursor()
+    buf = io.BytesIO()
+    with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as z:
+        for name in table_names:
+            path = os.path.join(tmp, f"{name}.parquet")
+            path_literal = path.replace("'", "''")
+            cur.execute(f"COPY \"{name}\" TO '{path_literal}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+            # already compressed, so stored as-is
+            z.write(path, f"{name}.parquet")
+    return buf.getvalue()
+
+
+def to_pandas_zero_copy(tbl: pa.Table, self_destruct: bool = False) -> pd.DataFrame:
+    """
+    Arrow -> pandas for Plotly. Columns become `pd.ArrowDtype` views over the Arrow buffers
+    rather than NumPy copies. Pass `self_destruct=True` only when `tbl` is not used afterwards.
+    """
+    return tbl.to_pandas(types_mapper=pd.ArrowDtype, split_blocks=True, self_destruct=self_destruct)
+
+
+def table_summary(con, table_names: List[str]) -> pa.Table:
+    """Row count, column count, column names and numeric column names per table, computed inside DuckDB."""
+    counts_sql = " UNION ALL ".join(
+        f"SELECT '{n}' AS table_name, COUNT(*) AS rows FROM \"{n}\"" for n in table_names
+    )
+    q = f"""
+        WITH counts AS ({counts_sql}),
+        cols AS (
+            SELECT table_name,
+                   list(column_name ORDER BY ordinal_position) AS columns,
+                   list(column_name ORDER BY ordinal_position) FILTER (
+                       WHERE data_type IN ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'FLOAT', 'DOUBLE')
+                          OR data_type LIKE 'DECIMAL%'
+                   ) AS numeric_columns
+            FROM information_schema.columns
+            GROUP BY table_name
+        )
+        SELECT counts.table_name, counts.rows, len(cols.columns) AS cols, cols.columns, cols.numeric_columns
+        FROM counts LEFT JOIN cols USING (table_name)"""
+    return run_sql(con, q)
+
+
+def correlation_matrix(con, table: str, columns: tuple) -> pd.DataFrame:
+    """
+    Pairwise correlations of numeric columns via DuckDB's corr() aggregate, in a single scan of `table`.
+
+    Constant columns (zero or undefined variance) have no correlation and are left out of the matrix.
+    """
+    pairs = [(a, b) for i, a in enumerate(columns) for b in columns[i + 1:]]
+    variances = ", ".join(f"var_samp(\"{c}\") AS v{i}" for i, c in enumerate(columns))
+    exprs = ", ".join(f"corr(\"{a}\", \"{b}\") AS c{i}" for i, (a, b) in enumerate(pairs))
+    tbl = run_sql(con, f"SELECT {variances}, {exprs} FROM \"{table}\"")
+    if not tbl.num_rows:
         return pd.DataFrame()
+    row = tbl.to_pylist()[0]
+    varying = [c for i, c in enumerate(columns) if row[f"v{i}"]]
+    matrix = pd.DataFrame(1.0, index=varying, columns=varying)
+    for i, (a, b) in enumerate(pairs):
+        if a in varying and b in varying:
+            matrix.loc[a, b] = matrix.loc[b, a] = row[f"c{i}"]
+    return matrix
+
+
+@st.cache_resource(show_spinner=False, hash_funcs={duckdb.DuckDBPyConnection: connection_key})
+def build_rental_fact(con, payment: str, rental: str, inventory: str, film: str, film_category: str, category: str) -> Optional[str]:
+    """Materialize the payment -> rental -> inventory -> film -> category join once per connection.
+
+    One row per payment and film category: a film with several categories repeats its payments
+    and a film without one drops out, so only per-category sums should read it. It is a regular
+    table rather than TEMP, because temp tables are only visible to the cursor that created
+    them. Returns the table name, or None if the join could not be built.
+    """
+    try:
+        with pooled_cursor(con) as (cur, _):
+            cur.execute(f"""CREATE OR REPLACE TABLE rental_fact AS
+                SELECT p.payment_id, p.amount, p.payment_date, r.rental_id, r.rental_date, r.return_date,
+                       f.film_id, f.title, f.rental_duration, c.name AS category_name
+                FROM "{payment}" p
+                JOIN "{rental}" r ON p.rental_id = r.rental_id
+                JOIN "{inventory}" i ON r.inventory_id = i.inventory_id
+                JOIN "{film}" f ON i.film_id = f.film_id
+                JOIN "{film_category}" fc ON f.film_id = fc.film_id
+                JOIN "{category}" c ON fc.category_id = c.category_id""")
+    except duckdb.Error:
+        return None
+    return 'rental_fact'
+
+
+@st.cache_resource(show_spinner=False)
+def late_returns_sql(rental: str, payment: str, inventory: str, film: str) -> str:
+    """
+    Per-return-status summary (min, quartiles, max, mean, count) of payment amounts, built once per
+    set of table names. NULL amounts are left out, so no status ends up with NULL quartiles.
+    """
+    late_src = f"(SELECT r.rental_date, r.return_date, f.rental_duration, p.amount FROM \"{rental}\" r JOIN \"{payment}\" p ON r.rental_id = p.rental_id JOIN \"{inventory}\" i ON r.inventory_id = i.inventory_id JOIN \"{film}\" f ON i.film_id = f.film_id)"
+    return f"SELECT return_status, min(amount) AS lo, approx_quantile(amount, [0.25, 0.5, 0.75]) AS q, max(amount) AS hi, avg(amount) AS mean, count(*) AS n FROM (SELECT CASE WHEN date_diff('day', CAST(rental_date AS DATE), CAST(return_date AS DATE)) > rental_duration THEN 'Late' ELSE 'On Time' END AS return_status, amount FROM {late_src} WHERE amount IS NOT NULL) GROUP BY return_status ORDER BY return_status"
+
+
+@st.cache_resource(show_spinner=False)
+def actor_sql(payment: str, rental: str, inventory: str, film_actor: str, actor: str, top_actors: int, film_category: Optional[str] = None, category: Optional[str] = None) -> str:
+    """
+    Top `top_actors` actors by revenue (is_total = 1) and, given the category tables, the top
+    500 actor/category flows (is_total = 0), each trimmed inside DuckDB to what is displayed.
+
+    Payments are joined and summed once, into per-(actor, film) revenue; the totals and the flows
+    both aggregate that CTE. Totals never touch the category tables, so films with zero or several
+    categories are counted exactly once.
+    """
+    actor_cols = "actor_id, first_name, last_name"
+    actor_name = "(first_name || ' ' || last_name) AS actor_name"
+    sql = (
+        f"WITH actor_film AS MATERIALIZED (SELECT a.actor_id, a.first_name, a.last_name, fr.film_id, fr.revenue FROM (SELECT i.film_id, SUM(p.amount) AS revenue FROM \"{payment}\" p JOIN \"{rental}\" r ON p.rental_id = r.rental_id JOIN \"{inventory}\" i ON r.inventory_id = i.inventory_id GROUP BY i.film_id) fr JOIN \"{film_actor}\" fa ON fr.film_id = fa.film_id JOIN \"{actor}\" a ON fa.actor_id = a.actor_id) "
+        f"SELECT * FROM (SELECT {actor_cols}, {actor_name}, CAST(NULL AS VARCHAR) AS category_name, SUM(revenue) AS revenue, 1 AS is_total FROM actor_film GROUP BY {actor_cols} ORDER BY revenue DESC LIMIT {int(top_actors)})"
+    )
+    if film_category and category:
+        sql += f" UNION ALL SELECT * FROM (SELECT {actor_cols}, {actor_name}, c.name AS category_name, SUM(af.revenue) AS revenue, 0 AS is_total FROM actor_film af JOIN \"{film_category}\" fc ON af.film_id = fc.film_id JOIN \"{category}\" c ON fc.category_id = c.category_id GROUP BY {actor_cols}, c.name ORDER BY revenue DESC LIMIT 500)"
+    return sql + " ORDER BY is_total DESC, revenue DESC"
+
+
+@st.cache_resource(show_spinner=False)
+def availability_sql(film: str, inventory: str, rental: str) -> SimpleNamespace:
+    """
+    Availability vs demand queries: `films` (top 200 films by rentals) and `bins` (every film
+    bucketed by copies and rentals of 5, for the scatter).
+
+    Copies and rentals are counted per film separately, then joined: joining inventory to rental
+    first would count a copy once per rental and multiply the join input.
+    """
+    base = f"WITH copies AS (SELECT film_id, COUNT(*) AS available_copies FROM \"{inventory}\" GROUP BY film_id), rentals AS (SELECT i.film_id, COUNT(*) AS rental_count FROM \"{rental}\" r JOIN \"{inventory}\" i ON r.inventory_id = i.inventory_id GROUP BY i.film_id) SELECT f.title AS film_title, COALESCE(copies.available_copies, 0) AS available_copies, COALESCE(rentals.rental_count, 0) AS rental_count FROM \"{film}\" f LEFT JOIN copies ON f.film_id = copies.film_id LEFT JOIN rentals ON f.film_id = rentals.film_id"
+    return SimpleNamespace(
+        films=f"{base} ORDER BY rental_count DESC, available_copies DESC LIMIT 200",
+        bins=f"SELECT available_copies, floor(rental_count / 5) * 5 AS rental_count, COUNT(*) AS films FROM ({base}) GROUP BY 1, 2",
+    )
+
+
+M4_BINS = 1500
+
+# below this many rows an exact COUNT(DISTINCT) is cheap, and HyperLogLog's error is largest
+# at low cardinality (720 vs 599 customers on the sample data), so fast preview stays exact
+APPROX_DISTINCT_MIN_ROWS = 5_000_000
+
+
+def m4_downsample(con, tbl: pa.Table, time_col: str, val_col: str, series_col: Optional[str] = None, bins: int = M4_BINS) -> pa.Table:
+    """
+    M4 downsampling in DuckDB: split the time range of `tbl` into `bins` equal buckets and keep
+    the first, last, min and max row of every bucket of every series, which draws the same line
+    at `bins` pixels wide with at most 4 points per bucket and series.
+
+    All series share one time grid, and a timestamp kept for any series is kept for all of them,
+    so stacked traces still line up. `tbl` is the already fetched result, queried in place on a
+    throwaway cursor rather than re-running its SQL. Only worth it when a series has many more
+    than 4 * `bins` rows (see `needs_m4`).
+    """
+    keys = f'"{series_col}", k' if series_col else 'k'
+    order = f', "{series_col}"' if series_col else ''
+    t = f'epoch("{time_col}")'
+    sql = f"""WITH bucketed AS (
+            SELECT *, coalesce(least({bins} - 1, floor({bins} * ({t} - min({t}) OVER ()) / nullif(max({t}) OVER () - min({t}) OVER (), 0))), 0) AS k
+            FROM m4_src
+        ), bounds AS (
+            SELECT {keys}, min("{val_col}") AS v_min, max("{val_col}") AS v_max, min("{time_col}") AS t_min, max("{time_col}") AS t_max
+            FROM bucketed GROUP BY {keys}
+        ), kept AS (
+            SELECT DISTINCT r."{time_col}"
+            FROM bucketed r JOIN bounds b USING ({keys})
+            WHERE r."{val_col}" IN (b.v_min, b.v_max) OR r."{time_col}" IN (b.t_min, b.t_max)
+        )
+        SELECT * FROM m4_src WHERE "{time_col}" IN (SELECT "{time_col}" FROM kept)
+        ORDER BY "{time_col}"{order}"""
+    cur = con.cursor()
+    try:
+        cur.register("m4_src", tbl)
+        return cur.execute(sql).to_arrow_table()
+    finally:
+        cur.close()
+
+
+def needs_m4(df: pd.DataFrame, series_col: Optional[str] = None, bins: int = M4_BINS) -> bool:
+    """True when some series of `df` has more than 4 * `bins` rows, the most M4 can keep."""
+    longest = df.groupby(series_col).size().max() if series_col else len(df)
+    return longest > 4 * bins
 
 
 def safe_plotly(fig):
@@ -116,19 +595,19 @@ folder = st.sidebar.text_input("CSV folder path (local)", value="./data")
 load_button = st.sidebar.button("Load CSVs from folder")
 st.sidebar.markdown("---")
 show_raw = st.sidebar.checkbox("Show raw tables after load", value=False)
-auto_coerce_dates = st.sidebar.checkbox("Auto-coerce likely date columns", value=True)
 compact_mode = st.sidebar.checkbox("Compact dashboard (cards + small charts)", value=True)
 max_rows_preview = st.sidebar.number_input("Max rows to preview", value=200, min_value=10, max_value=5000)
+fast_preview = st.sidebar.checkbox("Fast preview (approximate)", value=False, help="Approximate distinct counts on very large payment tables and a 50k-row payment sample for the top-customers view.")
 
 # ------------------------- Utility: discover tables -------------------------
 def folder_has_csvs(folder_path: str) -> bool:
-    return os.path.isdir(folder_path) and len(glob.glob(os.path.join(folder_path, "*.csv"))) > 0
+    return os.path.isdir(folder_path) and len(list_csv_files(folder_path)) > 0
 
 should_auto_load = folder_has_csvs(folder) and not load_button
 
 # ------------------------- Saved SQL queries (all 25) -------------------------
 SAVED_QUERIES = {
-    '1. Top 3 Spenders': textwrap.dedent("""
+    '1. Top 3 Spenders': """
         SELECT fullname, customer_id, total_spent
         FROM (
           SELECT (c.first_name || ' ' || c.last_name) AS fullname,
@@ -139,17 +618,17 @@ SAVED_QUERIES = {
           GROUP BY p.customer_id, fullname
           ORDER BY total_spent DESC
           LIMIT 3
-        ) AS derived_table;"""),
+        ) AS derived_table;""",
 
-    '2. Monthly Rentals per Store': textwrap.dedent("""
+    '2. Monthly Rentals per Store': """
         SELECT s.store_id, strftime(CAST(r.rental_date AS TIMESTAMP), '%Y') AS rental_year, strftime(CAST(r.rental_date AS TIMESTAMP), '%m') AS rental_month, COUNT(r.rental_id) AS rental_count
         FROM rental r
         JOIN staff st ON r.staff_id = st.staff_id
         JOIN store s ON st.store_id = s.store_id
         GROUP BY s.store_id, rental_year, rental_month
-        ORDER BY s.store_id, rental_year, rental_month;"""),
+        ORDER BY s.store_id, rental_year, rental_month;""",
 
-    '3. Film Categories & Rental Durations (quartiles)': textwrap.dedent("""
+    '3. Film Categories & Rental Durations (quartiles)': """
         WITH t1 AS (
             SELECT f.title AS film_title, c.name AS category_name, ntile(4) OVER (ORDER BY COALESCE(f.rental_duration,0)) AS standard_quartile
             FROM film f
@@ -160,9 +639,9 @@ SAVED_QUERIES = {
         FROM t1
         WHERE category_name IN ('Animation', 'Children', 'Classics', 'Comedy', 'Family', 'Music')
         GROUP BY category_name, standard_quartile
-        ORDER BY category_name, standard_quartile;"""),
+        ORDER BY category_name, standard_quartile;""",
 
-    '4. Top 10 Paying Customers Payment Patterns': textwrap.dedent("""
+    '4. Top 10 Paying Customers Payment Patterns': """
         WITH top_paying_customers AS (
             SELECT c.customer_id, (c.first_name || ' ' || c.last_name) AS customer_name, SUM(p.amount) AS total_payment
             FROM customer c
@@ -175,9 +654,9 @@ SAVED_QUERIES = {
         FROM payment p
         JOIN top_paying_customers tpc ON p.customer_id = tpc.customer_id
         GROUP BY tpc.customer_name, payment_month
-        ORDER BY tpc.customer_name, payment_month;"""),
+        ORDER BY tpc.customer_name, payment_month;""",
 
-    '5. Family Movie Rental Counts': textwrap.dedent("""
+    '5. Family Movie Rental Counts': """
         WITH t1 AS (
             SELECT f.title AS film_title, c.name AS category_name, r.rental_id
             FROM film f
@@ -190,9 +669,9 @@ SAVED_QUERIES = {
         FROM t1
         WHERE category_name IN ('Animation', 'Children', 'Classics', 'Comedy', 'Family', 'Music')
         GROUP BY film_title, category_name
-        ORDER BY category_name, film_title;"""),
+        ORDER BY category_name, film_title;""",
 
-    '6. Peak Activity by Store (monthly)': textwrap.dedent("""
+    '6. Peak Activity by Store (monthly)': """
         WITH result_table AS (
             SELECT strftime(CAST(r.rental_date AS TIMESTAMP), '%Y') AS year, strftime(CAST(r.rental_date AS TIMESTAMP), '%m') AS rental_month, st.store_id, COUNT(r.rental_id) AS rental_count
             FROM rental r
@@ -204,9 +683,9 @@ SAVED_QUERIES = {
                SUM(CASE WHEN store_id = 2 THEN rental_count ELSE 0 END) AS store_2_count
         FROM result_table
         GROUP BY year, rental_month
-        ORDER BY year, rental_month;"""),
+        ORDER BY year, rental_month;""",
 
-    '7. Family-friendly film orders (counts)': textwrap.dedent("""
+    '7. Family-friendly film orders (counts)': """
         WITH result_table AS (
             SELECT f.title AS film_title, cat.name AS category_name, COUNT(re.rental_id) AS num_rentals
             FROM film f
@@ -217,9 +696,9 @@ SAVED_QUERIES = {
             WHERE cat.name IN ('Animation', 'Children', 'Classics', 'Comedy', 'Family', 'Music')
             GROUP BY film_title, category_name
         )
-        SELECT * FROM result_table;"""),
+        SELECT * FROM result_table;""",
 
-    '8. Total Revenue by Category': textwrap.dedent("""
+    '8. Total Revenue by Category': """
         SELECT category.name AS category_name, SUM(payment.amount) AS total_revenue
         FROM category
         JOIN film_category ON category.category_id = film_category.category_id
@@ -228,25 +707,25 @@ SAVED_QUERIES = {
         JOIN rental ON inventory.inventory_id = rental.inventory_id
         JOIN payment ON rental.rental_id = payment.rental_id
         GROUP BY category.name
-        ORDER BY total_revenue DESC;"""),
+        ORDER BY total_revenue DESC;""",
 
-    '9. Total Rentals & Avg Rental Rate per Customer': textwrap.dedent("""
+    '9. Total Rentals & Avg Rental Rate per Customer': """
         SELECT customer.first_name, customer.last_name, customer.email, COUNT(rental.rental_id) AS total_rentals, AVG(payment.amount) AS average_rental_rate
         FROM customer
         LEFT JOIN rental ON customer.customer_id = rental.customer_id
         LEFT JOIN payment ON rental.rental_id = payment.rental_id
-        GROUP BY customer.first_name, customer.last_name, customer.email;"""),
+        GROUP BY customer.first_name, customer.last_name, customer.email;""",
 
-    '10. Highly Rented Films (>30)': textwrap.dedent("""
+    '10. Highly Rented Films (>30)': """
         SELECT film.title, COUNT(DISTINCT rental.rental_id) AS rental_count
         FROM film
         JOIN inventory ON film.film_id = inventory.film_id
         JOIN rental ON inventory.inventory_id = rental.inventory_id
         GROUP BY film.title
         HAVING rental_count > 30
-        ORDER BY rental_count DESC;"""),
+        ORDER BY rental_count DESC;""",
 
-    '11. City Rental Rates (avg)': textwrap.dedent("""
+    '11. City Rental Rates (avg)': """
         WITH CityRentalRates AS (
             SELECT city.city_id, city.city, AVG(payment.amount) AS avg_rental_rate
             FROM city
@@ -262,41 +741,41 @@ SAVED_QUERIES = {
                CASE WHEN cr.avg_rental_rate = mmr.max_rate THEN 'Highest Rate'
                     WHEN cr.avg_rental_rate = mmr.min_rate THEN 'Lowest Rate'
                     ELSE 'Standard Rate' END AS rate_status
-        FROM CityRentalRates cr CROSS JOIN MaxMinRates mmr;"""),
+        FROM CityRentalRates cr CROSS JOIN MaxMinRates mmr;""",
 
-    '12. Top customers by unique films rented (top 3)': textwrap.dedent("""
+    '12. Top customers by unique films rented (top 3)': """
         SELECT customer.customer_id, customer.first_name, customer.last_name, customer.email, COUNT(DISTINCT rental.inventory_id) AS unique_films_rented
         FROM customer
         JOIN rental ON customer.customer_id = rental.customer_id
         GROUP BY customer.customer_id, customer.first_name, customer.last_name, customer.email
         ORDER BY unique_films_rented DESC
-        LIMIT 3;"""),
+        LIMIT 3;""",
 
-    '13. Monthly Revenue Trends': textwrap.dedent("""
+    '13. Monthly Revenue Trends': """
         SELECT strftime(CAST(payment.payment_date AS TIMESTAMP), '%Y-%m') AS payment_month, SUM(payment.amount) AS monthly_revenue
         FROM payment
         GROUP BY payment_month
-        ORDER BY payment_month;"""),
+        ORDER BY payment_month;""",
 
-    '14. Most Active Stores (top 5)': textwrap.dedent("""
+    '14. Most Active Stores (top 5)': """
         SELECT store.store_id, COUNT(rental.rental_id) AS total_rentals
         FROM store
         LEFT JOIN staff ON store.store_id = staff.store_id
         LEFT JOIN rental ON staff.staff_id = rental.staff_id
         GROUP BY store.store_id
         ORDER BY total_rentals DESC
-        LIMIT 5;"""),
+        LIMIT 5;""",
 
-    '15. Customer Lifetime Value (top 5)': textwrap.dedent("""
+    '15. Customer Lifetime Value (top 5)': """
         SELECT customer.customer_id, customer.first_name, customer.last_name, COUNT(rental.rental_id) AS total_rentals, SUM(payment.amount) AS total_spent
         FROM customer
         LEFT JOIN rental ON customer.customer_id = rental.customer_id
         LEFT JOIN payment ON rental.rental_id = payment.rental_id
         GROUP BY customer.customer_id, customer.first_name, customer.last_name
         ORDER BY total_spent DESC
-        LIMIT 5;"""),
+        LIMIT 5;""",
 
-    '16. Loyalty Tiers by Rental Frequency': textwrap.dedent("""
+    '16. Loyalty Tiers by Rental Frequency': """
         SELECT customer.customer_id, customer.first_name, customer.last_name, COUNT(rental.rental_id) AS total_rentals,
                CASE WHEN COUNT(rental.rental_id) >= 50 THEN 'Platinum'
                     WHEN COUNT(rental.rental_id) >= 30 THEN 'Gold'
@@ -304,9 +783,9 @@ SAVED_QUERIES = {
         FROM customer
         LEFT JOIN rental ON customer.customer_id = rental.customer_id
         GROUP BY customer.customer_id, customer.first_name, customer.last_name
-        ORDER BY total_rentals DESC;"""),
+        ORDER BY total_rentals DESC;""",
 
-    '17. Monthly Revenue Growth Rate': textwrap.dedent("""
+    '17. Monthly Revenue Growth Rate': """
         WITH MonthlyRevenue AS (
             SELECT strftime(CAST(payment_date AS TIMESTAMP), '%Y-%m') AS payment_month, SUM(amount) AS monthly_revenue
             FROM payment
@@ -317,9 +796,9 @@ SAVED_QUERIES = {
                    (monthly_revenue - LAG(monthly_revenue) OVER (ORDER BY payment_month)) / NULLIF(LAG(monthly_revenue) OVER (ORDER BY payment_month),0) AS growth_rate
             FROM MonthlyRevenue
         )
-        SELECT payment_month, monthly_revenue, IFNULL(growth_rate, 0) AS growth_rate FROM RevenueGrowth;"""),
+        SELECT payment_month, monthly_revenue, IFNULL(growth_rate, 0) AS growth_rate FROM RevenueGrowth;""",
 
-    '18. Revenue, Cost & ROI by Category': textwrap.dedent("""
+    '18. Revenue, Cost & ROI by Category': """
         SELECT fc.category_id, c.name AS category_name, SUM(payment.amount) AS total_revenue,
                SUM(f.rental_duration * payment.amount) AS total_cost,
                SUM(payment.amount) - SUM(f.rental_duration * payment.amount) AS profit,
@@ -331,9 +810,9 @@ SAVED_QUERIES = {
         JOIN film_category fc ON f.film_id = fc.film_id
         JOIN category c ON fc.category_id = c.category_id
         GROUP BY fc.category_id, c.name
-        ORDER BY profit DESC;"""),
+        ORDER BY profit DESC;""",
 
-    '19. Rental Patterns Over Time': textwrap.dedent("""
+    '19. Rental Patterns Over Time': """
         WITH RentalPatterns AS (
             SELECT strftime(CAST(rental_date AS TIMESTAMP), '%Y-%m') AS rental_month, COUNT(rental_id) AS rental_count
             FROM rental
@@ -341,34 +820,34 @@ SAVED_QUERIES = {
         )
         SELECT rental_month, rental_count, LAG(rental_count) OVER (ORDER BY rental_month) AS prev_rental_count,
                (rental_count - LAG(rental_count) OVER (ORDER BY rental_month)) AS rental_growth
-        FROM RentalPatterns;"""),
+        FROM RentalPatterns;""",
 
-    '20. Late Returns Impact on Revenue': textwrap.dedent("""
+    '20. Late Returns Impact on Revenue': """
         SELECT CASE WHEN date_diff('day', CAST(r.rental_date AS DATE), CAST(r.return_date AS DATE)) > f.rental_duration THEN 'Late' ELSE 'On Time' END AS return_status,
                COUNT(r.rental_id) AS rental_count, SUM(p.amount) AS total_revenue
         FROM rental r
         JOIN payment p ON r.rental_id = p.rental_id
         JOIN inventory i ON r.inventory_id = i.inventory_id
         JOIN film f ON i.film_id = f.film_id
-        GROUP BY return_status;"""),
+        GROUP BY return_status;""",
 
-    '21. Most Popular Genres by Rentals': textwrap.dedent("""
+    '21. Most Popular Genres by Rentals': """
         SELECT category.name AS genre, COUNT(rental.rental_id) AS rental_count
         FROM rental
         JOIN inventory ON rental.inventory_id = inventory.inventory_id
         JOIN film ON inventory.film_id = film.film_id
         JOIN film_category ON film.film_id = film_category.film_id
         JOIN category ON film_category.category_id = category.category_id
-        GROUP BY genre ORDER BY rental_count DESC;"""),
+        GROUP BY genre ORDER BY rental_count DESC;""",
 
-    '22. Return Patterns by Day of Week': textwrap.dedent("""
+    '22. Return Patterns by Day of Week': """
         SELECT DAYNAME(return_date) AS day_of_week, COUNT(rental_id) AS rental_count
         FROM rental
         WHERE return_date IS NOT NULL
         GROUP BY day_of_week
-        ORDER BY FIELD(day_of_week, 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday');"""),
+        ORDER BY FIELD(day_of_week, 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday');""",
 
-    '23. Revenue by City': textwrap.dedent("""
+    '23. Revenue by City': """
         SELECT city.city, SUM(payment.amount) AS total_revenue
         FROM payment
         JOIN rental ON payment.rental_id = rental.rental_id
@@ -377,9 +856,9 @@ SAVED_QUERIES = {
         JOIN address ON store.address_id = address.address_id
         JOIN city ON address.city_id = city.city_id
         GROUP BY city.city
-        ORDER BY total_revenue DESC;"""),
+        ORDER BY total_revenue DESC;""",
 
-    '24. Most Profitable Actors': textwrap.dedent("""
+    '24. Most Profitable Actors': """
         SELECT a.actor_id, a.first_name, a.last_name, SUM(payment.amount) AS total_revenue
         FROM actor a
         JOIN film_actor fa ON a.actor_id = fa.actor_id
@@ -388,18 +867,23 @@ SAVED_QUERIES = {
         JOIN rental ON inventory.inventory_id = rental.inventory_id
         JOIN payment ON rental.rental_id = payment.rental_id
         GROUP BY a.actor_id, a.first_name, a.last_name
-        ORDER BY total_revenue DESC;"""),
+        ORDER BY total_revenue DESC;""",
 
-    '25. Film Availability & Demand (top 500)': textwrap.dedent("""
+    '25. Film Availability & Demand (top 500)': """
         SELECT f.title AS film_title, COUNT(i.inventory_id) AS available_copies, COUNT(r.rental_id) AS rental_count
         FROM film f
         LEFT JOIN inventory i ON f.film_id = i.film_id
         LEFT JOIN rental r ON i.inventory_id = r.inventory_id
         GROUP BY film_title
         ORDER BY rental_count DESC, available_copies DESC
-        LIMIT 500;"""),
+        LIMIT 500;""",
 }
 
+
+def execute_saved(con, name: str) -> pa.Table:
+    """Run one of SAVED_QUERIES by name; successful results are cached (see `cached_query`) so re-rendering the tab does not re-run it."""
+    return run_sql(con, SAVED_QUERIES[name], prepare=True)
+
 # ------------------------- Main app logic -------------------------
 if load_button or should_auto_load:
     if not os.path.isdir(folder):
@@ -407,72 +891,87 @@ if load_button or should_auto_load:
         st.stop()
 
     with st.spinner("Loading CSVs..."):
-        dfs = load_csvs_from_folder(folder)
-        if len(dfs) == 0:
+        csv_files = list_csv_files(folder)
+        if len(csv_files) == 0:
             st.sidebar.warning("No CSV files found in folder.")
             st.stop()
-        if auto_coerce_dates:
-            dfs = coerce_date_columns(dfs)
-        con = create_duckdb_connection(dfs)
+        con = create_duckdb_connection(folder, csv_files_key(folder))
 
-    st.sidebar.success(f"Loaded {len(dfs)} CSV files: {', '.join(list(dfs.keys())[:10])}")
+    table_names = [table_name_for(f) for f in csv_files]
+    st.sidebar.success(f"Loaded {len(table_names)} CSV files: {', '.join(table_names[:10])}")
 
     # Diagnostics (show table names + sample columns)
+    summary = table_summary(con, table_names)
     st.sidebar.markdown("### Loaded tables (preview)")
-    for name, df in dfs.items():
-        st.sidebar.markdown(f"**{name}** — {df.shape[0]} rows, {df.shape[1]} cols")
+    for row in summary.to_pylist():
+        st.sidebar.markdown(f"**{row['table_name']}** — {row['rows']} rows, {row['cols']} cols")
         # show up to first 20 column names
-        cols_preview = ", ".join([str(c) for c in df.columns[:20]]) + (", ..." if df.shape[1] > 20 else "")
+        cols_preview = ", ".join([str(c) for c in row['columns'][:20]]) + (", ..." if row['cols'] > 20 else "")
         st.sidebar.text(cols_preview)
 
     if show_raw:
-        st.markdown("### Raw tables (first 5 rows)")
-        for name, df in dfs.items():
+        # previews are pulled from DuckDB on demand; no DataFrame copy of the tables is kept
+        st.markdown(f"### Raw tables (first {max_rows_preview} rows)")
+        for name in table_names:
             st.markdown(f"**{name}**")
-            st.dataframe(df.head(5))
+            st.dataframe(preview(con, f"SELECT * FROM \"{name}\"", max_rows_preview))
 
-    # discover tables (helpers)
-    table_names = list(dfs.keys())
-    lower_names = [n.lower() for n in table_names]
+    # discover tables (helpers): lookup maps are built once, keeping the first table for duplicate keys
+    table_by_lower: Dict[str, str] = {}
+    table_by_sanitized: Dict[str, str] = {}
+    for name in table_names:
+        table_by_lower.setdefault(name.lower(), name)
+        table_by_sanitized.setdefault(name.lower().replace(' ', '_'), name)
 
-    def get_table(candidates: list[str]) -> Optional[str]:
+    def resolve_table(candidates: list[str]) -> Optional[str]:
         """
         Robust table finder:
           1) exact match (case-insensitive)
           2) sanitized match (lower + underscores)
           3) substring match
-        Returns the original table name key from dfs if found, else None.
+        Returns the original table name (CSV filename without extension) if found, else None.
         """
         # exact match
         for cand in candidates:
-            low = cand.lower()
-            for name in table_names:
-                if name.lower() == low:
-                    return name
+            name = table_by_lower.get(cand.lower())
+            if name:
+                return name
 
         # sanitized match
         for cand in candidates:
-            low = cand.lower().replace(' ', '_')
-            for name in table_names:
-                if name.lower().replace(' ', '_') == low:
-                    return name
+            name = table_by_sanitized.get(cand.lower().replace(' ', '_'))
+            if name:
+                return name
 
         # substring match
         for cand in candidates:
             low = cand.lower()
-            for i, n in enumerate(lower_names):
+            for n, name in table_by_lower.items():
                 if low in n:
-                    return table_names[i]
+                    return name
         return None
 
+    # resolved lookups persist for the session; they only change when the set of tables does
+    if st.session_state.get('table_map_names') != table_names:
+        st.session_state['table_map'] = {}
+        st.session_state['table_map_names'] = table_names
+    table_map: Dict[tuple, Optional[str]] = st.session_state['table_map']
+
+    def get_table(candidates: list[str]) -> Optional[str]:
+        """Cached `resolve_table`: each candidate list is resolved once per session and set of tables."""
+        key = tuple(candidates)
+        if key not in table_map:
+            table_map[key] = resolve_table(candidates)
+        return table_map[key]
+
     # main UI
     st.title("📊 DVD Rental — Interactive Analytics Dashboard")
 
     # Header/cards
     col1, col2, col3, col4 = st.columns(4)
-    row_counts = {k: v.shape[0] for k, v in dfs.items()}
+    row_counts = dict(zip(summary.column('table_name').to_pylist(), summary.column('rows').to_pylist()))
     total_rows = sum(row_counts.values())
-    total_tables = len(dfs)
+    total_tables = len(table_names)
 
     with col1:
         st.markdown('<div class="card">', unsafe_allow_html=True)
@@ -484,7 +983,7 @@ if load_button or should_auto_load:
         st.markdown('</div>', unsafe_allow_html=True)
     with col3:
         st.markdown('<div class="card">', unsafe_allow_html=True)
-        max_rows_table = max((v.shape[0] for v in dfs.values()), default=0)
+        max_rows_table = max(row_counts.values(), default=0)
         st.markdown(f"<div class=\"compact-metric\">Largest table rows</div><div>{max_rows_table}</div>", unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
     with col4:
@@ -492,10 +991,32 @@ if load_button or should_auto_load:
         st.markdown('<div class="compact-metric">Quick actions</div><div class="small-muted">Saved Queries • Export tables</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
-    tabs = st.tabs(["Overview", "Customers", "Rentals & Stores", "Categories & Films", "Revenue", "Actors", "Advanced SQL"])
+    # every table the tabs use, resolved once per rerun (None when missing)
+    T = SimpleNamespace(
+        actor=get_table(['actor']),
+        category=get_table(['category']),
+        customer=get_table(['customer']),
+        film=get_table(['film']),
+        film_actor=get_table(['film_actor', 'filmactor']),
+        film_category=get_table(['film_category', 'filmcategory', 'film-category']),
+        inventory=get_table(['inventory']),
+        payment=get_table(['payment']),
+        rental=get_table(['rental']),
+        staff=get_table(['staff']),
+        store=get_table(['store']),
+    )
+
+    # denormalized join for the per-category revenue query
+    fact_sources = [T.payment, T.rental, T.inventory, T.film, T.film_category, T.category]
+    fact_tbl = build_rental_fact(con, *fact_sources) if all(fact_sources) else None
+
+    # each tab body is a fragment: its own widgets rerun only that tab, not every query on the page
+    # lazy tabs: only the selected tab's body runs (and builds its queries and figures) on a rerun
+    tabs = st.tabs(["Overview", "Customers", "Rentals & Stores", "Categories & Films", "Revenue", "Actors", "Advanced SQL"], key='active_tab', on_change='rerun')
 
     # ------------------------- Overview tab -------------------------
-    with tabs[0]:
+    @st.fragment
+    def render_overview_tab():
         st.header("Overview & Dataset Health")
         counts_df = pd.DataFrame(row_counts.items(), columns=["table", "rows"]).sort_values('rows', ascending=False)
         st.dataframe(counts_df)
@@ -504,41 +1025,65 @@ if load_button or should_auto_load:
             fig = px.bar(top8, x='table', y='rows', title='Top tables by row count')
             safe_plotly(fig)
 
+        # numeric correlations for the table with the most numeric columns
+        # key columns (`id`, `*_id`) are identifiers, not measures, so they are not correlated
+        measures = {r['table_name']: [c for c in (r['numeric_columns'] or []) if c.lower() != 'id' and not c.lower().endswith('_id')] for r in summary.to_pylist()}
+        numeric_tables = [r for r in summary.to_pylist() if len(measures[r['table_name']]) >= 2]
+        if numeric_tables:
+            best = max(numeric_tables, key=lambda r: (len(measures[r['table_name']]), r['rows']))
+            best_table = best['table_name']
+            corr = correlation_matrix(con, best_table, tuple(measures[best_table]))
+            if len(corr.columns) >= 2:
+                heat_corr = go.Figure(data=go.Heatmap(z=corr.values, x=corr.columns, y=corr.index, zmin=-1, zmax=1, colorscale='RdBu', colorbar=dict(title='corr')))
+                heat_corr.update_layout(title=f'Correlation heatmap — {best_table}')
+                safe_plotly(heat_corr)
+
         # quick payment metrics
-        pay_tbl = get_table(['payment'])
-        if pay_tbl:
-            q_metrics = f"SELECT COUNT(*) AS payments_count, SUM(amount) AS total_revenue, AVG(amount) AS avg_payment FROM \"{pay_tbl}\""
-            df_metrics = run_sql(con, q_metrics)
-            if not df_metrics.empty:
-                mc = df_metrics.iloc[0].to_dict()
-                c1, c2, c3 = st.columns(3)
+        if T.payment:
+            approx_customers = fast_preview and row_counts.get(T.payment, 0) >= APPROX_DISTINCT_MIN_ROWS
+            distinct_customers = "approx_count_distinct(customer_id)" if approx_customers else "COUNT(DISTINCT customer_id)"
+            q_metrics = f"SELECT COUNT(*) AS payments_count, {distinct_customers} AS customers, SUM(amount) AS total_revenue, AVG(amount) AS avg_payment FROM \"{T.payment}\""
+            tbl_metrics = run_sql(con, q_metrics, prepare=True)
+            if tbl_metrics.num_rows:
+                mc = tbl_metrics.slice(0, 1).to_pylist()[0]
+                c1, c2, c3, c4 = st.columns(4)
                 c1.metric("Payments", int(mc.get('payments_count', 0)))
-                c2.metric("Total revenue", f"{mc.get('total_revenue', 0):,.2f}")
-                c3.metric("Avg payment", f"{mc.get('avg_payment', 0):,.2f}")
+                c2.metric("Paying customers" + (" (approx.)" if approx_customers else ""), int(mc.get('customers', 0)))
+                c3.metric("Total revenue", f"{mc.get('total_revenue', 0):,.2f}")
+                c4.metric("Avg payment", f"{mc.get('avg_payment', 0):,.2f}")
+
+    with tabs[0]:
+        if tabs[0].open:
+            render_overview_tab()
 
     # ------------------------- Customers tab -------------------------
-    with tabs[1]:
+    @st.fragment
+    def render_customers_tab():
         st.header("Customers & Top Spenders")
-        customer_tbl = get_table(['customer'])
-        payment_tbl = get_table(['payment'])
 
-        if customer_tbl and payment_tbl:
-            q = f"SELECT (c.first_name || ' ' || c.last_name) AS fullname, p.customer_id, SUM(p.amount) AS total_spent FROM \"{payment_tbl}\" p JOIN \"{customer_tbl}\" c USING (customer_id) GROUP BY p.customer_id, fullname ORDER BY total_spent DESC LIMIT 500"
-            df_top = run_sql(con, q)
-            st.subheader("Top customers — table")
-            st.dataframe(df_top.head(max_rows_preview))
+        if T.customer and T.payment:
+            # fast preview aggregates a fixed reservoir sample of payments instead of the full table
+            payment_src = f'(SELECT * FROM "{T.payment}" USING SAMPLE reservoir(50000 ROWS) REPEATABLE (42))' if fast_preview else f'"{T.payment}"'
+            # cum_pct feeds the Pareto chart: running share of spend within the top 500
+            q = f"SELECT fullname, customer_id, total_spent, SUM(total_spent) OVER (ORDER BY total_spent DESC, customer_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) / SUM(total_spent) OVER () AS cum_pct FROM (SELECT (c.first_name || ' ' || c.last_name) AS fullname, p.customer_id, SUM(p.amount) AS total_spent FROM {payment_src} p JOIN \"{T.customer}\" c USING (customer_id) GROUP BY p.customer_id, fullname ORDER BY total_spent DESC LIMIT 500) ORDER BY total_spent DESC, customer_id"
+            tbl_top = run_sql(con, q, prepare=True)
+            df_top = to_pandas_zero_copy(tbl_top)
+            st.subheader("Top customers — table" + (" (sampled)" if fast_preview else ""))
+            st.dataframe(tbl_top.slice(0, max_rows_preview))
 
             if not df_top.empty:
                 safe_plotly(px.bar(df_top.head(25), x='total_spent', y='fullname', orientation='h', title='Top 25 customers by spend'))
-                safe_plotly(px.histogram(df_top, x='total_spent', nbins=30, title='Distribution of total spent (top customers)'))
-
-                # Pareto cumulative line (combined)
-                df_pareto = df_top.sort_values('total_spent', ascending=False).reset_index(drop=True)
-                total_sum = df_pareto['total_spent'].sum() if not df_pareto.empty else 1
-                df_pareto['cum_pct'] = df_pareto['total_spent'].cumsum() / total_sum
+                # bins are drawn from the Arrow column directly, without Plotly Express' per-call DataFrame handling
+                fig_hist = go.Figure(go.Histogram(x=tbl_top.column('total_spent').to_numpy(), nbinsx=30))
+                fig_hist.update_layout(title='Distribution of total spent (top customers)', xaxis_title='total_spent', yaxis_title='count')
+                safe_plotly(fig_hist)
+
+                # Pareto cumulative line (combined); cum_pct comes from the SQL window, read straight off the Arrow result
+                pareto = tbl_top.slice(0, 30)
+                pareto_names = pareto.column('fullname').to_pylist()
                 fig_p = make_subplots(specs=[[{"secondary_y": True}]])
-                fig_p.add_trace(go.Bar(x=df_pareto['fullname'].head(30), y=df_pareto['total_spent'].head(30), name='spend'))
-                fig_p.add_trace(go.Scatter(x=df_pareto['fullname'].head(30), y=df_pareto['cum_pct'].head(30), name='cumulative %', yaxis='y2'))
+                fig_p.add_trace(go.Bar(x=pareto_names, y=pareto.column('total_spent').to_numpy(), name='spend'))
+                fig_p.add_trace(go.Scattergl(x=pareto_names, y=pareto.column('cum_pct').to_numpy(), name='cumulative %'), secondary_y=True)
                 fig_p.update_yaxes(title_text='Spend', secondary_y=False)
                 fig_p.update_yaxes(title_text='Cumulative %', secondary_y=True, tickformat='.0%')
                 fig_p.update_layout(title='Pareto — top customers (top 30)')
@@ -546,128 +1091,156 @@ if load_button or should_auto_load:
         else:
             st.warning('customer or payment table not found — rename or place your csv files with those names in the folder.')
 
+    with tabs[1]:
+        if tabs[1].open:
+            render_customers_tab()
+
     # ------------------------- Rentals & Stores -------------------------
-    with tabs[2]:
+    @st.fragment
+    def render_rentals_tab():
         st.header('Rentals — Monthly, By Store & Peak Activity')
-        rental_tbl = get_table(['rental'])
-        staff_tbl = get_table(['staff'])
-        store_tbl = get_table(['store'])
 
-        if rental_tbl and staff_tbl and store_tbl:
-            q = f"SELECT s.store_id, strftime(CAST(r.rental_date AS TIMESTAMP), '%Y-%m') AS ym, COUNT(r.rental_id) AS rentals FROM \"{rental_tbl}\" r JOIN \"{staff_tbl}\" st ON r.staff_id = st.staff_id JOIN \"{store_tbl}\" s ON st.store_id = s.store_id GROUP BY s.store_id, ym ORDER BY ym"
-            df_month = run_sql(con, q)
+        if T.rental and T.staff and T.store:
+            q = f"SELECT s.store_id, date_trunc('month', CAST(r.rental_date AS TIMESTAMP)) AS ym, COUNT(r.rental_id) AS rentals FROM \"{T.rental}\" r JOIN \"{T.staff}\" st ON r.staff_id = st.staff_id JOIN \"{T.store}\" s ON st.store_id = s.store_id GROUP BY s.store_id, ym ORDER BY ym"
+            tbl_month = run_sql(con, q, prepare=True)
+            df_month = to_pandas_zero_copy(tbl_month)
             if not df_month.empty:
-                df_month['ym_dt'] = pd.to_datetime(df_month['ym'] + '-01', errors='coerce')
-                safe_plotly(px.area(df_month, x='ym_dt', y='rentals', color='store_id', title='Monthly rentals by store'))
-                safe_plotly(px.bar(df_month, x='ym_dt', y='rentals', color='store_id', title='Stacked monthly rentals'))
-
-                # heatmap
-                df_month['year'] = df_month['ym_dt'].dt.year.astype(str)
-                df_month['month'] = df_month['ym_dt'].dt.month
-                pivot = df_month.pivot_table(index='year', columns='month', values='rentals', aggfunc='sum', fill_value=0)
-                heat = go.Figure(data=go.Heatmap(z=pivot.values, x=pivot.columns, y=pivot.index, colorbar=dict(title='rentals')))
-                heat.update_layout(title='Rentals heatmap (year vs month)')
-                safe_plotly(heat)
+                df_area = df_month
+                if needs_m4(df_month, 'store_id'):
+                    df_area = to_pandas_zero_copy(m4_downsample(con, tbl_month, 'ym', 'rentals', series_col='store_id'), self_destruct=True)
+                safe_plotly(px.area(df_area, x='ym', y='rentals', color='store_id', title='Monthly rentals by store'))
+                # one trace per store (rows are already aggregated by DuckDB, so the loop is store-count sized)
+                fig_stack = go.Figure([go.Bar(x=grp['ym'], y=grp['rentals'], name=f'store {store_id}') for store_id, grp in df_month.groupby('store_id', sort=True)])
+                fig_stack.update_layout(barmode='stack', title='Stacked monthly rentals', xaxis_title='ym', yaxis_title='rentals', legend_title_text='store_id')
+                safe_plotly(fig_stack)
+
+                # heatmap: DuckDB emits the year x month grid directly (one column per month, 0 where empty)
+                q_heat = f"PIVOT (SELECT year(CAST(rental_date AS TIMESTAMP)) AS year, month(CAST(rental_date AS TIMESTAMP)) AS month FROM \"{T.rental}\") ON month USING count(*) GROUP BY year ORDER BY year"
+                tbl_heat = run_sql(con, q_heat, prepare=True)
+                if tbl_heat.num_rows:
+                    months = sorted((c for c in tbl_heat.column_names if c != 'year'), key=int)
+                    # PIVOT rows are already the heatmap rows; transpose the month columns without a pandas frame
+                    z = [list(row) for row in zip(*(tbl_heat.column(m).to_pylist() for m in months))]
+                    years = [str(y) for y in tbl_heat.column('year').to_pylist()]
+                    heat = go.Figure(data=go.Heatmap(z=z, x=[int(m) for m in months], y=years, colorbar=dict(title='rentals')))
+                    heat.update_layout(title='Rentals heatmap (year vs month)')
+                    safe_plotly(heat)
         else:
             st.warning('rental/staff/store tables missing — rentals visuals unavailable.')
 
+    with tabs[2]:
+        if tabs[2].open:
+            render_rentals_tab()
+
     # ------------------------- Categories & Films -------------------------
-    with tabs[3]:
+    @st.fragment
+    def render_categories_tab():
         st.header('Film Categories, Quartiles & Family Rentals')
-        film_tbl = get_table(['film'])
-        film_cat_tbl = get_table(['film_category', 'filmcategory', 'film-category'])
-        cat_tbl = get_table(['category'])
 
-        if film_tbl and film_cat_tbl and cat_tbl:
-            q_quart = f"WITH t1 AS (SELECT f.title AS film_title, c.name AS category_name, ntile(4) OVER (ORDER BY COALESCE(f.rental_duration,0)) AS quart FROM \"{film_tbl}\" f JOIN \"{film_cat_tbl}\" fc ON f.film_id = fc.film_id JOIN \"{cat_tbl}\" c ON fc.category_id = c.category_id) SELECT category_name, quart AS standard_quartile, COUNT(film_title) AS film_count FROM t1 WHERE category_name IN ('Animation','Children','Classics','Comedy','Family','Music') GROUP BY category_name, standard_quartile ORDER BY category_name, standard_quartile"
-            df_quart = run_sql(con, q_quart)
+        if T.film and T.film_category and T.category:
+            q_quart = f"WITH t1 AS (SELECT f.title AS film_title, c.name AS category_name, ntile(4) OVER (ORDER BY COALESCE(f.rental_duration,0)) AS quart FROM \"{T.film}\" f JOIN \"{T.film_category}\" fc ON f.film_id = fc.film_id JOIN \"{T.category}\" c ON fc.category_id = c.category_id) SELECT category_name, quart AS standard_quartile, COUNT(film_title) AS film_count FROM t1 WHERE category_name IN ('Animation','Children','Classics','Comedy','Family','Music') GROUP BY category_name, standard_quartile ORDER BY category_name, standard_quartile"
+            tbl_quart = run_sql(con, q_quart, prepare=True)
+            df_quart = to_pandas_zero_copy(tbl_quart)
             st.subheader('Film quartiles by rental_duration')
-            st.dataframe(df_quart.head(500))
+            st.dataframe(tbl_quart.slice(0, 500))
             if not df_quart.empty:
                 safe_plotly(px.bar(df_quart, x='standard_quartile', y='film_count', color='category_name', barmode='group', title='Film counts by quartile & category'))
 
-            inv_tbl = get_table(['inventory'])
-            rental_tbl_local = get_table(['rental'])
-            if inv_tbl and rental_tbl_local:
-                q_family = f"WITH t1 AS (SELECT f.title AS film_title, c.name AS category_name, r.rental_id FROM \"{film_tbl}\" f JOIN \"{film_cat_tbl}\" fc ON f.film_id = fc.film_id JOIN \"{cat_tbl}\" c ON fc.category_id = c.category_id JOIN \"{inv_tbl}\" i ON f.film_id = i.film_id JOIN \"{rental_tbl_local}\" r ON i.inventory_id = r.inventory_id) SELECT category_name, film_title, COUNT(rental_id) AS rentals FROM t1 WHERE category_name IN ('Animation','Children','Classics','Comedy','Family','Music') GROUP BY category_name, film_title ORDER BY rentals DESC LIMIT 500"
-                df_family = run_sql(con, q_family)
+            if T.inventory and T.rental:
+                q_family = f"WITH t1 AS (SELECT f.title AS film_title, c.name AS category_name, r.rental_id FROM \"{T.film}\" f JOIN \"{T.film_category}\" fc ON f.film_id = fc.film_id JOIN \"{T.category}\" c ON fc.category_id = c.category_id JOIN \"{T.inventory}\" i ON f.film_id = i.film_id JOIN \"{T.rental}\" r ON i.inventory_id = r.inventory_id) SELECT category_name, film_title, COUNT(rental_id) AS rentals FROM t1 WHERE category_name IN ('Animation','Children','Classics','Comedy','Family','Music') GROUP BY category_name, film_title ORDER BY rentals DESC LIMIT 500"
+                df_family = to_pandas_zero_copy(run_sql(con, q_family, prepare=True), self_destruct=True)
                 if not df_family.empty:
                     safe_plotly(px.treemap(df_family, path=['category_name','film_title'], values='rentals', title='Family categories treemap'))
                     safe_plotly(px.sunburst(df_family, path=['category_name','film_title'], values='rentals', title='Family categories sunburst'))
         else:
             st.warning('film or film_category or category tables missing — category visuals limited.')
 
+    with tabs[3]:
+        if tabs[3].open:
+            render_categories_tab()
+
     # ------------------------- Revenue -------------------------
-    with tabs[4]:
+    @st.fragment
+    def render_revenue_tab():
         st.header('Revenue: Trends, Categories & Late Returns')
-        pay_tbl = get_table(['payment'])
-        if pay_tbl:
-            q_rev = f"SELECT strftime(CAST(payment.payment_date AS TIMESTAMP), '%Y-%m') AS ym, SUM(payment.amount) AS revenue FROM \"{pay_tbl}\" payment GROUP BY ym ORDER BY ym"
-            df_rev = run_sql(con, q_rev)
+        if T.payment:
+            # moving averages come from window frames over the monthly rows, in the same query
+            q_rev = f"SELECT ym, revenue, AVG(revenue) OVER (ORDER BY ym ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) AS ma_3, AVG(revenue) OVER (ORDER BY ym ROWS BETWEEN 5 PRECEDING AND CURRENT ROW) AS ma_6 FROM (SELECT date_trunc('month', CAST(payment.payment_date AS TIMESTAMP)) AS ym, SUM(payment.amount) AS revenue FROM \"{T.payment}\" payment GROUP BY ym) ORDER BY ym"
+            tbl_rev = run_sql(con, q_rev, prepare=True)
+            df_rev = to_pandas_zero_copy(tbl_rev)
             if not df_rev.empty:
-                df_rev['ym_dt'] = pd.to_datetime(df_rev['ym'] + '-01', errors='coerce')
-                safe_plotly(px.line(df_rev, x='ym_dt', y='revenue', markers=True, title='Monthly revenue'))
+                df_line = df_rev
+                if needs_m4(df_rev):
+                    df_line = to_pandas_zero_copy(m4_downsample(con, tbl_rev, 'ym', 'revenue'), self_destruct=True)
+                safe_plotly(px.line(df_line, x='ym', y='revenue', markers=True, render_mode='webgl', title='Monthly revenue'))
 
                 # moving averages
-                df_rev = df_rev.sort_values('ym_dt')
-                df_rev['ma_3'] = df_rev['revenue'].rolling(3, min_periods=1).mean()
-                df_rev['ma_6'] = df_rev['revenue'].rolling(6, min_periods=1).mean()
                 fig_ma = go.Figure()
-                fig_ma.add_trace(go.Scatter(x=df_rev['ym_dt'], y=df_rev['revenue'], name='monthly'))
-                fig_ma.add_trace(go.Scatter(x=df_rev['ym_dt'], y=df_rev['ma_3'], name='3-mo MA', line=dict(dash='dash')))
-                fig_ma.add_trace(go.Scatter(x=df_rev['ym_dt'], y=df_rev['ma_6'], name='6-mo MA', line=dict(dash='dot')))
+                fig_ma.add_trace(go.Scatter(x=df_rev['ym'], y=df_rev['revenue'], name='monthly'))
+                fig_ma.add_trace(go.Scatter(x=df_rev['ym'], y=df_rev['ma_3'], name='3-mo MA', line=dict(dash='dash')))
+                fig_ma.add_trace(go.Scatter(x=df_rev['ym'], y=df_rev['ma_6'], name='6-mo MA', line=dict(dash='dot')))
                 fig_ma.update_layout(title='Revenue with moving averages')
                 safe_plotly(fig_ma)
 
         # revenue by category
-        if all([pay_tbl, film_tbl, film_cat_tbl, cat_tbl, get_table(['inventory']), get_table(['rental'])]):
-            inv = get_table(['inventory'])
-            rent = get_table(['rental'])
-            q_cat = f"SELECT c.name AS category_name, SUM(p.amount) AS total_revenue FROM \"{cat_tbl}\" c JOIN \"{film_cat_tbl}\" fc ON c.category_id = fc.category_id JOIN \"{film_tbl}\" f ON fc.film_id = f.film_id JOIN \"{inv}\" i ON f.film_id = i.film_id JOIN \"{rent}\" r ON i.inventory_id = r.inventory_id JOIN \"{pay_tbl}\" p ON r.rental_id = p.rental_id GROUP BY c.name ORDER BY total_revenue DESC"
-            df_cat_rev = run_sql(con, q_cat)
+        if fact_tbl:
+            q_cat = f"SELECT category_name, SUM(amount) AS total_revenue FROM \"{fact_tbl}\" GROUP BY category_name ORDER BY total_revenue DESC"
+            tbl_cat_rev = run_sql(con, q_cat, prepare=True)
+            df_cat_rev = to_pandas_zero_copy(tbl_cat_rev)
             st.subheader('Revenue by category')
-            st.dataframe(df_cat_rev.head(200))
+            st.dataframe(tbl_cat_rev.slice(0, 200))
             if not df_cat_rev.empty:
                 safe_plotly(px.bar(df_cat_rev.head(12), x='category_name', y='total_revenue', title='Top categories by revenue'))
-                safe_plotly(px.violin(df_cat_rev, y='total_revenue', box=True, points='all', title='Revenue distribution by category'))
+                safe_plotly(px.violin(df_cat_rev, y='total_revenue', box=True, points='outliers', title='Revenue distribution by category'))
 
         # late returns impact
-        rent = get_table(['rental'])
-        if all([rent, pay_tbl, film_tbl, get_table(['inventory'])]):
-            inv = get_table(['inventory'])
-            q_late = f"SELECT CASE WHEN date_diff('day', CAST(r.rental_date AS DATE), CAST(r.return_date AS DATE)) > f.rental_duration THEN 'Late' ELSE 'On Time' END AS return_status, p.amount AS amount FROM \"{rent}\" r JOIN \"{pay_tbl}\" p ON r.rental_id = p.rental_id JOIN \"{inv}\" i ON r.inventory_id = i.inventory_id JOIN \"{film_tbl}\" f ON i.film_id = f.film_id"
-            df_late = run_sql(con, q_late)
-            if not df_late.empty:
-                safe_plotly(px.box(df_late, x='return_status', y='amount', title='Payment amount distribution by return status'))
+        if all([T.rental, T.payment, T.film, T.inventory]):
+            # only per-status summary stats (min, quartiles, max, mean, count) leave DuckDB; the box is drawn from them directly
+            q_late = late_returns_sql(T.rental, T.payment, T.inventory, T.film)
+            tbl_late = run_sql(con, q_late, prepare=True)
+            if tbl_late.num_rows:
+                statuses = [f"{status} (n={n:,})" for status, n in zip(tbl_late.column('return_status').to_pylist(), tbl_late.column('n').to_pylist())]
+                q1, median, q3 = zip(*tbl_late.column('q').to_pylist())
+                fig_late = go.Figure(go.Box(x=statuses, lowerfence=tbl_late.column('lo').to_pylist(), q1=q1, median=median, q3=q3, upperfence=tbl_late.column('hi').to_pylist(), mean=tbl_late.column('mean').to_pylist(), boxmean=True, name='amount'))
+                fig_late.update_layout(title='Payment amount distribution by return status', xaxis_title='return_status', yaxis_title='amount')
+                safe_plotly(fig_late)
+
+    with tabs[4]:
+        if tabs[4].open:
+            render_revenue_tab()
 
     # ------------------------- Actors -------------------------
-    with tabs[5]:
+    @st.fragment
+    def render_actors_tab():
         st.header('Actors — revenue & flows')
-        actor_tbl = get_table(['actor'])
-        film_actor_tbl = get_table(['film_actor', 'filmactor'])
-        inv_tbl = get_table(['inventory'])
-        rent_tbl = get_table(['rental'])
-        pay_tbl = get_table(['payment'])
-
-        if all([actor_tbl, film_actor_tbl, inv_tbl, rent_tbl, pay_tbl, film_tbl, film_cat_tbl, cat_tbl]):
-            q_actor = f"SELECT a.actor_id, a.first_name, a.last_name, SUM(p.amount) AS total_revenue FROM \"{actor_tbl}\" a JOIN \"{film_actor_tbl}\" fa ON a.actor_id = fa.actor_id JOIN \"{film_tbl}\" f ON fa.film_id = f.film_id JOIN \"{inv_tbl}\" i ON f.film_id = i.film_id JOIN \"{rent_tbl}\" r ON i.inventory_id = r.inventory_id JOIN \"{pay_tbl}\" p ON r.rental_id = p.rental_id GROUP BY a.actor_id, a.first_name, a.last_name ORDER BY total_revenue DESC LIMIT 200"
-            df_actor = run_sql(con, q_actor)
+
+        if all([T.actor, T.film_actor, T.inventory, T.rental, T.payment]):
+            # the flows only run when asked for (and need the category tables)
+            show_flows = bool(T.film_category and T.category) and st.checkbox('Show actor -> category flow (Sankey)', value=False, key='show_flows')
+            flow_tables = (T.film_category, T.category) if show_flows else (None, None)
+            q_actor = actor_sql(T.payment, T.rental, T.inventory, T.film_actor, T.actor, max(40, min(int(max_rows_preview), 200)), *flow_tables)
+            tbl_actor_all = run_sql(con, q_actor, prepare=True)
             st.subheader('Top actors by revenue')
-            if not df_actor.empty:
-                st.dataframe(df_actor.head(max_rows_preview))
-                safe_plotly(px.bar(df_actor.head(40), x='last_name', y='total_revenue', hover_data=['first_name'], title='Top actors by revenue'))
-
-                # Sankey sample
-                q_sankey = f"SELECT (a.first_name || ' ' || a.last_name) AS actor_name, c.name AS category_name, SUM(p.amount) AS revenue FROM \"{actor_tbl}\" a JOIN \"{film_actor_tbl}\" fa ON a.actor_id = fa.actor_id JOIN \"{film_tbl}\" f ON fa.film_id = f.film_id JOIN \"{film_cat_tbl}\" fc ON f.film_id = fc.film_id JOIN \"{cat_tbl}\" c ON fc.category_id = c.category_id JOIN \"{inv_tbl}\" i ON f.film_id = i.film_id JOIN \"{rent_tbl}\" r ON i.inventory_id = r.inventory_id JOIN \"{pay_tbl}\" p ON r.rental_id = p.rental_id GROUP BY actor_name, category_name ORDER BY revenue DESC LIMIT 500"
-                df_sankey = run_sql(con, q_sankey)
-                if not df_sankey.empty:
-                    actors = df_sankey['actor_name'].unique().tolist()
-                    cats = df_sankey['category_name'].unique().tolist()
-                    nodes = actors + cats
-                    idx = {n: i for i, n in enumerate(nodes)}
-                    sources = [idx[a] for a in df_sankey['actor_name']]
-                    targets = [idx[c] for c in df_sankey['category_name']]
-                    values = df_sankey['revenue'].tolist()
+            if tbl_actor_all.num_rows:
+                totals = pc.equal(tbl_actor_all['is_total'], 1)
+                tbl_actor = tbl_actor_all.filter(totals).select(['actor_id', 'first_name', 'last_name', 'revenue']).rename_columns(['actor_id', 'first_name', 'last_name', 'total_revenue'])
+                st.dataframe(tbl_actor.slice(0, max_rows_preview))
+                # only the plotted head is converted to pandas
+                safe_plotly(px.bar(to_pandas_zero_copy(tbl_actor.slice(0, 40)), x='last_name', y='total_revenue', hover_data=['first_name'], title='Top actors by revenue'))
+
+                # Sankey sample, only worth drawing with more than one actor
+                tbl_flows = tbl_actor_all.filter(pc.invert(totals)).select(['actor_name', 'category_name', 'revenue'])
+                if show_flows and tbl_actor.num_rows >= 2 and tbl_flows.num_rows:
+                    # dictionary encoding gives node indices without a Python-level lookup per row;
+                    # dictionaries keep first-appearance order, i.e. by revenue, since rows arrive sorted
+                    actor_codes = tbl_flows['actor_name'].combine_chunks().dictionary_encode()
+                    cat_codes = tbl_flows['category_name'].combine_chunks().dictionary_encode()
+                    actors = actor_codes.dictionary.to_pylist()
+                    nodes = actors + cat_codes.dictionary.to_pylist()
+                    # links go to Plotly as NumPy arrays (serialized as typed binary arrays), not per-value Python lists
+                    sources = actor_codes.indices.to_numpy()
+                    targets = pc.add(cat_codes.indices.cast(pa.int64()), len(actors)).to_numpy()
+                    values = tbl_flows['revenue'].to_numpy()
                     sankey = go.Figure(data=[go.Sankey(node=dict(label=nodes, pad=15, thickness=18), link=dict(source=sources, target=targets, value=values))])
                     sankey.update_layout(title='Actor -> Category revenue flow (sample)', font_size=10)
                     safe_plotly(sankey)
@@ -675,33 +1248,29 @@ if load_button or should_auto_load:
             st.info('Actor analysis unavailable — some actor/film_actor/inventory/rental/payment tables are missing.')
 
         # availability vs demand
-        if film_tbl and inv_tbl and rent_tbl:
-            q_avail = f"SELECT f.title AS film_title, COUNT(i.inventory_id) AS available_copies, COUNT(r.rental_id) AS rental_count FROM \"{film_tbl}\" f LEFT JOIN \"{inv_tbl}\" i ON f.film_id = i.film_id LEFT JOIN \"{rent_tbl}\" r ON i.inventory_id = r.inventory_id GROUP BY film_title ORDER BY rental_count DESC, available_copies DESC LIMIT 500"
-            df_avail = run_sql(con, q_avail)
-            if not df_avail.empty:
+        if T.film and T.inventory and T.rental:
+            q_avail = availability_sql(T.film, T.inventory, T.rental)
+            tbl_avail = run_sql(con, q_avail.films, prepare=True)
+            if tbl_avail.num_rows:
                 st.subheader('Availability vs Demand — films')
-                st.dataframe(df_avail.head(200))
-                safe_plotly(px.scatter(df_avail, x='available_copies', y='rental_count', size='rental_count', hover_data=['film_title'], title='Availability vs Demand'))
+                st.dataframe(tbl_avail)
+                # bucket every film server-side so the point count stays bounded however many films there are
+                df_avail_bins = to_pandas_zero_copy(run_sql(con, q_avail.bins, prepare=True), self_destruct=True)
+                safe_plotly(px.scatter(df_avail_bins, x='available_copies', y='rental_count', size='films', labels={'rental_count': 'rental_count (buckets of 5)'}, render_mode='webgl', title='Availability vs Demand'))
+
+    with tabs[5]:
+        if tabs[5].open:
+            render_actors_tab()
 
     # ------------------------- Advanced SQL & Saved Queries -------------------------
-    with tabs[6]:
+    @st.fragment
+    def render_advanced_tab():
         st.header('Advanced — SQL Explorer & Saved Queries')
-        st.markdown('Run ad-hoc SQL against DuckDB. Click any saved query button to run it.')
-
-        names = list(SAVED_QUERIES.keys())
-        ncols = 3
-        rows = (len(names) + ncols - 1) // ncols
-        for r in range(rows):
-            cols = st.columns(ncols)
-            for cidx in range(ncols):
-                idx = r * ncols + cidx
-                if idx >= len(names):
-                    break
-                name = names[idx]
-                q = SAVED_QUERIES[name]
-                if cols[cidx].button(name):
-                    df_q = run_sql(con, q)
-                    st.dataframe(df_q)
+        st.markdown('Run ad-hoc SQL against DuckDB, or pick a saved query and run it.')
+
+        choice = st.selectbox('Saved query', list(SAVED_QUERIES.keys()), key='saved_query')
+        if st.button('Run saved query'):
+            st.dataframe(execute_saved(con, choice))
 
         st.markdown('---')
         custom_sql = st.text_area('Enter SQL (use double quotes for table names if needed)', height=200)
@@ -709,8 +1278,12 @@ if load_button or should_auto_load:
             if not custom_sql.strip():
                 st.warning('Please enter SQL.')
             else:
-                df_custom = run_sql(con, custom_sql)
-                st.dataframe(df_custom.head(500))
+                tbl_custom = run_custom_sql(con, custom_sql)
+                df_custom = to_pandas_zero_copy(tbl_custom)
+                st.dataframe(tbl_custom.slice(0, max_rows_preview))
+                if tbl_custom.num_columns:
+                    # serialized only when the button is clicked
+                    st.download_button('Download full result (Parquet)', data=lambda: parquet_bytes(tbl_custom), file_name='query_result.parquet', mime='application/vnd.apache.parquet')
                 if not df_custom.empty:
                     cols = df_custom.columns.tolist()
                     x_col = st.selectbox('X axis', options=cols, key='adv_x')
@@ -719,9 +1292,9 @@ if load_button or should_auto_load:
                     if st.button('Plot result'):
                         try:
                             if chart_type == 'scatter':
-                                fig = px.scatter(df_custom, x=x_col, y=y_col, title='Custom scatter')
+                                fig = px.scatter(df_custom, x=x_col, y=y_col, render_mode='webgl', title='Custom scatter')
                             elif chart_type == 'line':
-                                fig = px.line(df_custom, x=x_col, y=y_col, title='Custom line')
+                                fig = px.line(df_custom, x=x_col, y=y_col, render_mode='webgl', title='Custom line')
                             elif chart_type == 'bar':
                                 fig = px.bar(df_custom, x=x_col, y=y_col, title='Custom bar')
                             elif chart_type == 'box':
@@ -737,14 +1310,35 @@ if load_button or should_auto_load:
                         except Exception as e:
                             st.error(f'Plot error: {e}')
 
+    with tabs[6]:
+        if tabs[6].open:
+            render_advanced_tab()
+
     # ------------------------- Export -------------------------
     st.sidebar.markdown('---')
     if st.sidebar.button('Export tables to CSV'):
         export_dir = os.path.join(folder, 'exported_tables')
         os.makedirs(export_dir, exist_ok=True)
-        for name, df in dfs.items():
-            df.to_csv(os.path.join(export_dir, f"{name}.csv"), index=False)
-        st.sidebar.success(f'Exported {len(dfs)} tables to {export_dir}')
+
+        def export(name: str) -> None:
+            out_path = os.path.join(export_dir, f"{name}.csv")
+            cur = con.cursor()
+            try:
+                # DuckDB's CSV writer is parallel and never materializes the table in pandas
+                out_literal = out_path.replace("'", "''")
+                cur.execute(f"COPY \"{name}\" TO '{out_literal}' (FORMAT CSV, HEADER)")
+            except duckdb.Error:
+                # Arrow's C++ CSV writer rather than pandas' per-row formatting
+                pacsv.write_csv(cur.execute(f"SELECT * FROM \"{name}\"").to_arrow_table(), out_path)
+
+        if table_names:
+            # one table per thread; both writers release the GIL
+            with ThreadPoolExecutor(max_workers=min(8, len(table_names))) as ex:
+                list(ex.map(export, table_names))
+        st.sidebar.success(f'Exported {len(table_names)} tables to {export_dir}')
+
+    # built only when clicked, in the background
+    st.sidebar.download_button('Download all tables (Parquet, ZIP)', lambda: tables_zip(con, tuple(table_names)), file_name='tables.zip', mime='application/zip')
 
     st.success('Dashboard ready — explore the tabs above.')
 
@@ -754,4 +1348,4 @@ else:
     st.info("Put your CSVs into the folder './data' (or enter another path), then click 'Load CSVs from folder'.")
     st.markdown('---')
     st.write('Supported visuals: time-series, area, stacked bars, heatmaps, treemaps, sankey, violin/box, scatter, correlation heatmap.')
-    st.code('pip install streamlit pandas duckdb plotly')
+    st.code('pip install "streamlit>=1.55" pandas "duckdb>=1.5" pyarrow plotly')